@@ -5,13 +5,27 @@ Provides tools for DAG management, monitoring, debugging, and connection testing
 """
 
 import asyncio
+import base64
 import os
-import subprocess
+import random
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Optional
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Mapping, Optional
 from datetime import datetime
 
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
 import httpx
+import msgspec
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from mcp.server import Server
 from mcp.types import Tool, TextContent
@@ -20,33 +34,217 @@ import mcp.server.stdio
 # Load environment variables
 load_dotenv()
 
-# Airflow API configuration
-AIRFLOW_API_URL = os.getenv("airflow_api_url", "http://localhost:8080/api/v2")
-AIRFLOW_BASE_URL = os.getenv("airflow_baseurl", "http://localhost:8080")
-AIRFLOW_USERNAME = os.getenv("airflow_username", "airflow")
-AIRFLOW_PASSWORD = os.getenv("airflow_password", "airflow")
-AIRFLOW_JWT_TOKEN = os.getenv("airflow_jwt_token")
 
-# Initialize MCP server
-app = Server("airflow-mcp-server")
+# Airflow API configuration
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Airflow connection settings, read from the environment once at startup."""
+    api_url: str
+    base_url: str
+    username: str
+    # Secrets are kept out of repr so the config can be logged safely
+    password: str = field(repr=False)
+    jwt_token: Optional[str] = field(repr=False)
+    auth_headers: Mapping[str, str] = field(repr=False)
 
 
-def get_auth_headers() -> dict[str, str]:
-    """Get authentication headers for Airflow API requests."""
-    if AIRFLOW_JWT_TOKEN:
-        return {
-            "Authorization": f"Bearer {AIRFLOW_JWT_TOKEN}",
-            "Content-Type": "application/json",
-        }
+def load_config() -> Config:
+    """Build the server configuration from environment variables."""
+    api_url = os.getenv("airflow_api_url", "http://localhost:8080/api/v2")
+    base_url = os.getenv("airflow_baseurl", "http://localhost:8080")
+    username = os.getenv("airflow_username", "airflow")
+    password = os.getenv("airflow_password", "airflow")
+    jwt_token = os.getenv("airflow_jwt_token")
+    
+    # Authentication headers for Airflow API requests - the strategy is chosen once,
+    # since the credentials never change after startup
+    if jwt_token:
+        authorization = f"Bearer {jwt_token}"
     else:
         # Basic auth fallback
-        import base64
-        credentials = f"{AIRFLOW_USERNAME}:{AIRFLOW_PASSWORD}"
-        encoded = base64.b64encode(credentials.encode()).decode()
-        return {
-            "Authorization": f"Basic {encoded}",
+        credentials = f"{username}:{password}"
+        authorization = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+    
+    return Config(
+        api_url=api_url,
+        base_url=base_url,
+        username=username,
+        password=password,
+        jwt_token=jwt_token,
+        auth_headers=MappingProxyType({
+            "Authorization": authorization,
             "Content-Type": "application/json",
-        }
+        }),
+    )
+
+
+CFG = load_config()
+
+# State indicators used when rendering DAG runs and task instances
+_RUN_STATE_EMOJI = {
+    "success": "✅",
+    "failed": "❌",
+    "running": "🔄",
+    "queued": "⏳",
+}
+_TI_STATE_EMOJI = {**_RUN_STATE_EMOJI, "skipped": "⏭️"}
+
+
+# Typed schemas for the high-volume list endpoints. Decoding straight into these
+# skips unknown fields; defaults mirror the placeholder shown when a field is absent.
+class Dag(msgspec.Struct, frozen=True):
+    dag_id: str
+    is_paused: Optional[bool] = None
+    description: Any = "N/A"
+    schedule_interval: Any = "N/A"
+
+
+class DagCollection(msgspec.Struct, frozen=True):
+    dags: list[Dag] = []
+
+
+class DagRun(msgspec.Struct, frozen=True):
+    dag_run_id: str
+    state: Optional[str] = "N/A"
+    start_date: Any = "N/A"
+    end_date: Any = "N/A"
+
+
+class DagRunCollection(msgspec.Struct, frozen=True):
+    dag_runs: list[DagRun] = []
+
+
+class TaskInstance(msgspec.Struct, frozen=True):
+    task_id: str
+    state: Optional[str] = "N/A"
+    try_number: Any = "N/A"
+    duration: Any = "N/A"
+
+
+class TaskInstanceCollection(msgspec.Struct, frozen=True):
+    task_instances: list[TaskInstance] = []
+
+
+class Connection(msgspec.Struct, frozen=True):
+    connection_id: str
+    conn_type: Any = "N/A"
+    host: Any = "N/A"
+    schema: Any = "N/A"
+
+
+class ConnectionCollection(msgspec.Struct, frozen=True):
+    connections: list[Connection] = []
+
+
+# Initialize MCP server
+app = Server("airflow-mcp-server")
+
+
+# Shared HTTP client - reuses pooled keep-alive (HTTP/2) connections across tool calls
+_CLIENT = httpx.AsyncClient(
+    # Trailing slash so relative endpoints are appended to the API path
+    base_url=CFG.api_url.rstrip("/") + "/",
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+    headers=CFG.auth_headers,
+)
+
+# Short-lived cache for GET responses - absorbs bursts of repeated read-only tool calls
+_GET_CACHE: TTLCache = TTLCache(maxsize=256, ttl=5)
+
+
+# Retry policy for transient failures. Requests that are not idempotent are only
+# retried when Airflow cannot have acted on them (429 or a failed connect).
+_MAX_ATTEMPTS = 3
+_RETRY_STATUS_CODES = frozenset({429, 502, 503, 504})
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class TokenBucketRateLimiter:
+    """
+    Async token bucket that caps how fast requests are sent to Airflow.
+    
+    Allows bursts of up to max_tokens requests; tokens refill continuously
+    so the whole bucket is restored every refill_interval seconds.
+    """
+    
+    def __init__(self, max_tokens: int, refill_interval: float):
+        self.max_tokens = max_tokens
+        self.refill_interval = refill_interval
+        self._tokens = float(max_tokens)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                refill = (now - self._updated) * self.max_tokens / self.refill_interval
+                self._tokens = min(self.max_tokens, self._tokens + refill)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self._tokens) * self.refill_interval / self.max_tokens)
+    
+    async def __aenter__(self) -> None:
+        await self.acquire()
+    
+    async def __aexit__(self, *exc_info) -> None:
+        return None
+
+
+_LIMITER = TokenBucketRateLimiter(max_tokens=20, refill_interval=1.0)
+
+
+def get_error_detail(response: httpx.Response) -> str:
+    """Extract the error message from a failed API response."""
+    try:
+        error_json = orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        return response.text
+    if isinstance(error_json, dict):
+        return error_json.get("detail", response.text)
+    return response.text
+
+
+async def send_with_retry(
+    method: str,
+    endpoint: str,
+    params: Optional[dict] = None,
+    content: Optional[bytes] = None,
+) -> httpx.Response:
+    """
+    Send a rate-limited request, retrying transient failures with jittered backoff.
+    
+    Returns:
+        The last response received; raises the last transport error if every attempt failed
+    """
+    idempotent = method in _IDEMPOTENT_METHODS
+    
+    for attempt in range(_MAX_ATTEMPTS):
+        last_attempt = attempt == _MAX_ATTEMPTS - 1
+        try:
+            async with _LIMITER:
+                response = await _CLIENT.request(
+                    method=method,
+                    url=endpoint.removeprefix("/"),
+                    params=params,
+                    content=content,
+                )
+        except httpx.TransportError as e:
+            if last_attempt or not (idempotent or isinstance(e, httpx.ConnectError)):
+                raise
+        else:
+            retryable = idempotent or response.status_code == 429
+            if last_attempt or not retryable or response.status_code not in _RETRY_STATUS_CODES:
+                return response
+        
+        await asyncio.sleep(0.2 * 2 ** attempt + random.uniform(0, 0.1))
 
 
 async def make_api_request(
@@ -54,696 +252,1026 @@ async def make_api_request(
     endpoint: str,
     params: Optional[dict] = None,
     json_data: Optional[dict] = None,
-) -> dict[str, Any]:
+    cache_bypass: bool = False,
+    response_type: Optional[type] = None,
+) -> Any:
     """
     Make an API request to Airflow with proper error handling.
     
+    GET responses are cached for a few seconds; any other method clears
+    the cache so later reads reflect the change.
+    
     Args:
         method: HTTP method (GET, POST, PATCH, etc.)
         endpoint: API endpoint path (without base URL)
         params: Query parameters
         json_data: JSON body for POST/PATCH requests
+        cache_bypass: If true, always hit the API for GET requests
+        response_type: Optional msgspec Struct to decode the response into
         
     Returns:
-        API response as dictionary
+        API response as dictionary, or as response_type if given
     """
-    url = f"{AIRFLOW_API_URL}/{endpoint.lstrip('/')}"
-    headers = get_auth_headers()
+    cache_key = None
+    if method == "GET" and not cache_bypass:
+        cache_key = (endpoint, tuple(sorted((params or {}).items())), response_type)
+        cached = _GET_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                params=params,
-                json=json_data,
+        response = await send_with_retry(
+            method,
+            endpoint,
+            params=params,
+            # Content-Type: application/json is already part of the default headers
+            content=orjson.dumps(json_data) if json_data is not None else None,
+        )
+        response.raise_for_status()
+        if response_type is not None:
+            result = msgspec.json.decode(response.content, type=response_type)
+        else:
+            result = orjson.loads(response.content)
+        if cache_key is not None:
+            _GET_CACHE[cache_key] = result
+        return result
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"API request failed ({e.response.status_code}): {get_error_detail(e.response)}")
+    except httpx.RequestError as e:
+        raise Exception(f"Connection error: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Unexpected error: {str(e)}")
+    finally:
+        if method != "GET":
+            _GET_CACHE.clear()
+
+
+# Keys of an Airflow 3 structured log record that format_log_record renders itself
+_LOG_RECORD_KEYS = frozenset({"timestamp", "level", "event", "error_detail"})
+
+
+def format_log_record(record: Any) -> str:
+    """
+    Render one structured log record the way the Airflow UI shows it.
+    
+    Produces "[timestamp] LEVEL - event key=value ...", followed by any
+    error_detail formatted as a Python traceback.
+    """
+    if not isinstance(record, dict):
+        return str(record)
+    
+    parts = []
+    if record.get("timestamp"):
+        parts.append(f"[{record['timestamp']}] ")
+    if record.get("level"):
+        parts.append(f"{str(record['level']).upper()} - ")
+    parts.append(str(record.get("event", "")))
+    parts.extend(f" {key}={value}" for key, value in record.items() if key not in _LOG_RECORD_KEYS)
+    
+    error_detail = record.get("error_detail")
+    if isinstance(error_detail, list):
+        for error in error_detail:
+            if not isinstance(error, dict):
+                parts.append(f"\n{error}")
+                continue
+            if error.get("is_cause"):
+                parts.append("\n\nThe above exception was the direct cause of the following exception:\n")
+            parts.append("\nTraceback (most recent call last):")
+            parts.extend(
+                f'\n  File "{frame.get("filename")}", line {frame.get("lineno")}, in {frame.get("name")}'
+                for frame in error.get("frames") or []
             )
+            parts.append(f"\n{error.get('exc_type')}: {error.get('exc_value')}")
+    elif error_detail:
+        parts.append(f"\n{error_detail}")
+    
+    return "".join(parts)
+
+
+async def stream_log_events(
+    endpoint: str,
+    params: Optional[dict] = None,
+    max_chars: int = 200_000,
+) -> str:
+    """
+    Stream a task log as NDJSON, keeping only the tail of the rendered records.
+    
+    Task logs can be far larger than anything useful to return to the
+    client. The Airflow 3 log route streams one JSON record per line when
+    asked for application/x-ndjson; each record is rendered with
+    format_log_record, and memory stays bounded by max_chars plus the
+    longest single record. That bound only holds for NDJSON: a server that
+    ignores the Accept header and sends the whole {"content": [...]}
+    envelope on one line is buffered and decoded in full.
+    
+    Args:
+        endpoint: API endpoint path (without base URL)
+        params: Query parameters
+        max_chars: Maximum number of trailing characters to keep
+        
+    Returns:
+        The last max_chars characters of the rendered log
+    """
+    try:
+        await _LIMITER.acquire()
+        async with _CLIENT.stream(
+            "GET",
+            endpoint.removeprefix("/"),
+            params=params,
+            headers={"Accept": "application/x-ndjson"},
+        ) as response:
+            if response.is_error:
+                await response.aread()
             response.raise_for_status()
-            return response.json()
+            
+            lines: deque[str] = deque()
+            size = 0
+            truncated = False
+            async for raw_line in response.aiter_lines():
+                if not raw_line.strip():
+                    continue
+                try:
+                    record = orjson.loads(raw_line)
+                except orjson.JSONDecodeError:
+                    record = raw_line
+                
+                # A server that ignores the Accept header sends the JSON envelope instead
+                if isinstance(record, dict) and "event" not in record and "content" in record:
+                    content = record["content"]
+                    records = content if isinstance(content, list) else [content]
+                else:
+                    records = [record]
+                
+                for entry in records:
+                    line = f"{format_log_record(entry)}\n"
+                    lines.append(line)
+                    size += len(line)
+                    # Drop whole leading lines until the tail fits the window
+                    while size > max_chars and len(lines) > 1:
+                        size -= len(lines.popleft())
+                        truncated = True
     except httpx.HTTPStatusError as e:
-        error_detail = e.response.text
-        try:
-            error_json = e.response.json()
-            error_detail = error_json.get("detail", error_detail)
-        except:
-            pass
-        raise Exception(f"API request failed ({e.response.status_code}): {error_detail}")
+        raise Exception(f"API request failed ({e.response.status_code}): {get_error_detail(e.response)}")
     except httpx.RequestError as e:
         raise Exception(f"Connection error: {str(e)}")
     except Exception as e:
         raise Exception(f"Unexpected error: {str(e)}")
+    
+    text = "".join(lines).removesuffix("\n")
+    if len(text) > max_chars:
+        text = text[-max_chars:]
+        truncated = True
+    if truncated:
+        text = f"[... earlier output truncated, showing last {max_chars} characters ...]\n{text}"
+    return text
 
 
-@app.list_tools()
-async def list_tools() -> list[Tool]:
-    """List all available MCP tools."""
-    return [
-        # DAG Management Tools
-        Tool(
-            name="get_dags",
-            description="List all DAGs in Airflow with optional filtering by paused status",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "only_active": {
-                        "type": "boolean",
-                        "description": "If true, only return active (unpaused) DAGs",
-                    },
-                    "limit": {
-                        "type": "integer",
-                        "description": "Maximum number of DAGs to return (default: 100)",
-                        "default": 100,
-                    },
+# Tool definitions are static, so build them once at import
+_TOOLS: list[Tool] = [
+    # DAG Management Tools
+    Tool(
+        name="get_dags",
+        description="List all DAGs in Airflow with optional filtering by paused status",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "only_active": {
+                    "type": "boolean",
+                    "description": "If true, only return active (unpaused) DAGs",
                 },
-            },
-        ),
-        Tool(
-            name="get_dag_tasks",
-            description="Get all tasks in a specific DAG",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG",
-                    },
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum number of DAGs to return (default: 100)",
+                    "default": 100,
                 },
-                "required": ["dag_id"],
             },
-        ),
-        Tool(
-            name="trigger_dag_run",
-            description="Trigger a new DAG run",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG to trigger",
-                    },
-                    "conf": {
-                        "type": "object",
-                        "description": "Optional configuration JSON to pass to the DAG run",
-                    },
-                    "logical_date": {
-                        "type": "string",
-                        "description": "Optional logical date for the DAG run (ISO format)",
-                    },
+        },
+    ),
+    Tool(
+        name="get_dag_tasks",
+        description="Get all tasks in a specific DAG",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG",
                 },
-                "required": ["dag_id"],
             },
-        ),
-        Tool(
-            name="clear_dag_run",
-            description="Clear/retry a DAG run (resets failed tasks)",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG",
-                    },
-                    "dag_run_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG run to clear",
-                    },
-                    "dry_run": {
-                        "type": "boolean",
-                        "description": "If true, only show what would be cleared without actually clearing",
-                        "default": False,
-                    },
+            "required": ["dag_id"],
+        },
+    ),
+    Tool(
+        name="trigger_dag_run",
+        description="Trigger a new DAG run",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG to trigger",
                 },
-                "required": ["dag_id", "dag_run_id"],
-            },
-        ),
-        Tool(
-            name="set_dag_state",
-            description="Pause or unpause a DAG",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG",
-                    },
-                    "is_paused": {
-                        "type": "boolean",
-                        "description": "True to pause the DAG, False to unpause it",
-                    },
+                "conf": {
+                    "type": "object",
+                    "description": "Optional configuration JSON to pass to the DAG run",
+                },
+                "logical_date": {
+                    "type": "string",
+                    "description": "Optional logical date for the DAG run (ISO format)",
                 },
-                "required": ["dag_id", "is_paused"],
             },
-        ),
-        
-        # Monitoring & Status Tools
-        Tool(
-            name="get_dag_runs",
-            description="Get DAG run history with optional status filtering",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG",
-                    },
-                    "state": {
-                        "type": "string",
-                        "description": "Filter by state (success, failed, running, queued)",
-                    },
-                    "limit": {
-                        "type": "integer",
-                        "description": "Maximum number of runs to return (default: 25)",
-                        "default": 25,
-                    },
+            "required": ["dag_id"],
+        },
+    ),
+    Tool(
+        name="clear_dag_run",
+        description="Clear/retry a DAG run (resets failed tasks)",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG",
+                },
+                "dag_run_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG run to clear",
+                },
+                "dry_run": {
+                    "type": "boolean",
+                    "description": "If true, only show what would be cleared without actually clearing",
+                    "default": False,
                 },
-                "required": ["dag_id"],
             },
-        ),
-        Tool(
-            name="get_task_instances",
-            description="Get task instances for a specific DAG run",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG",
-                    },
-                    "dag_run_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG run",
-                    },
+            "required": ["dag_id", "dag_run_id"],
+        },
+    ),
+    Tool(
+        name="set_dag_state",
+        description="Pause or unpause a DAG",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG",
+                },
+                "is_paused": {
+                    "type": "boolean",
+                    "description": "True to pause the DAG, False to unpause it",
                 },
-                "required": ["dag_id", "dag_run_id"],
             },
-        ),
-        Tool(
-            name="get_dag_stats",
-            description="Get aggregate statistics for all DAGs",
-            inputSchema={
-                "type": "object",
-                "properties": {},
+            "required": ["dag_id", "is_paused"],
+        },
+    ),
+    
+    # Monitoring & Status Tools
+    Tool(
+        name="get_dag_runs",
+        description="Get DAG run history with optional status filtering",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG",
+                },
+                "state": {
+                    "type": "string",
+                    "description": "Filter by state (success, failed, running, queued)",
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum number of runs to return (default: 25)",
+                    "default": 25,
+                },
             },
-        ),
-        
-        # Debugging & Logs Tools
-        Tool(
-            name="get_task_logs",
-            description="Get execution logs for a specific task instance",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "dag_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG",
-                    },
-                    "dag_run_id": {
-                        "type": "string",
-                        "description": "The ID of the DAG run",
-                    },
-                    "task_id": {
-                        "type": "string",
-                        "description": "The ID of the task",
-                    },
-                    "try_number": {
-                        "type": "integer",
-                        "description": "The try number of the task (default: 1)",
-                        "default": 1,
-                    },
+            "required": ["dag_id"],
+        },
+    ),
+    Tool(
+        name="get_task_instances",
+        description="Get task instances for a specific DAG run",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG",
+                },
+                "dag_run_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG run",
                 },
-                "required": ["dag_id", "dag_run_id", "task_id"],
             },
-        ),
-        Tool(
-            name="get_import_errors",
-            description="Get DAG import/parsing errors",
-            inputSchema={
-                "type": "object",
-                "properties": {},
+            "required": ["dag_id", "dag_run_id"],
+        },
+    ),
+    Tool(
+        name="get_dag_stats",
+        description="Get aggregate statistics for all DAGs",
+        inputSchema={
+            "type": "object",
+            "properties": {},
+        },
+    ),
+    
+    # Debugging & Logs Tools
+    Tool(
+        name="get_task_logs",
+        description="Get execution logs for a specific task instance",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "dag_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG",
+                },
+                "dag_run_id": {
+                    "type": "string",
+                    "description": "The ID of the DAG run",
+                },
+                "task_id": {
+                    "type": "string",
+                    "description": "The ID of the task",
+                },
+                "try_number": {
+                    "type": "integer",
+                    "description": "The try number of the task (default: 1)",
+                    "default": 1,
+                },
             },
-        ),
-        
-        # Connection Management Tools
-        Tool(
-            name="get_connections",
-            description="List all Airflow connections",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "limit": {
-                        "type": "integer",
-                        "description": "Maximum number of connections to return (default: 100)",
-                        "default": 100,
-                    },
+            "required": ["dag_id", "dag_run_id", "task_id"],
+        },
+    ),
+    Tool(
+        name="get_import_errors",
+        description="Get DAG import/parsing errors",
+        inputSchema={
+            "type": "object",
+            "properties": {},
+        },
+    ),
+    
+    # Connection Management Tools
+    Tool(
+        name="get_connections",
+        description="List all Airflow connections",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum number of connections to return (default: 100)",
+                    "default": 100,
                 },
             },
-        ),
-        Tool(
-            name="get_connection",
-            description="Get details of a specific connection",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "connection_id": {
-                        "type": "string",
-                        "description": "The ID of the connection",
-                    },
+        },
+    ),
+    Tool(
+        name="get_connection",
+        description="Get details of a specific connection",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "connection_id": {
+                    "type": "string",
+                    "description": "The ID of the connection",
                 },
-                "required": ["connection_id"],
             },
-        ),
-        Tool(
-            name="test_connection",
-            description="Test a connection to verify it works",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "connection_id": {
-                        "type": "string",
-                        "description": "The ID of the connection to test",
-                    },
+            "required": ["connection_id"],
+        },
+    ),
+    Tool(
+        name="test_connection",
+        description="Test a connection to verify it works",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "connection_id": {
+                    "type": "string",
+                    "description": "The ID of the connection to test",
                 },
-                "required": ["connection_id"],
             },
-        ),
+            "required": ["connection_id"],
+        },
+    ),
+    
+    # Knowledge Tools
+    Tool(
+        name="get_airflow3_skill",
+        description="Get Airflow 3 development guidelines and syntax changes",
+        inputSchema={
+            "type": "object",
+            "properties": {},
+        },
+    ),
+    
+    # Health Check Tool
+    Tool(
+        name="check_health",
+        description="Check Airflow system health (scheduler and database status)",
+        inputSchema={
+            "type": "object",
+            "properties": {},
+        },
+    ),
+]
+
+
+@app.list_tools()
+async def list_tools() -> list[Tool]:
+    """List all available MCP tools."""
+    return _TOOLS
+
+
+def get_fields(data: dict, keys: tuple[str, ...], default: Any = "N/A") -> tuple:
+    """
+    Look up several response fields at once, substituting a default for missing ones.
+    
+    default is either one placeholder for every key, or a tuple holding one
+    placeholder per key.
+    """
+    get = data.get
+    if isinstance(default, tuple):
+        return tuple(map(get, keys, default))
+    return tuple(get(key, default) for key in keys)
+
+
+# DAG Management Tools
+
+async def _handle_get_dags(arguments: dict) -> str:
+    """List DAGs, optionally only active ones."""
+    only_active = arguments.get("only_active", False)
+    limit = arguments.get("limit", 100)
+    
+    params = {"limit": limit}
+    if only_active:
+        params["only_active"] = "true"
+    
+    result = await make_api_request("GET", "dags", params=params, response_type=DagCollection)
+    dags = result.dags
+    
+    parts = [f"Found {len(dags)} DAGs:\n\n"]
+    for dag in dags:
+        status = "⏸️ Paused" if dag.is_paused else "▶️ Active"
+        parts.append(
+            f"- **{dag.dag_id}** ({status})\n"
+            f"  - Description: {dag.description}\n"
+            f"  - Schedule: {dag.schedule_interval}\n\n"
+        )
+    
+    return "".join(parts)
+
+
+async def _handle_get_dag_tasks(arguments: dict) -> str:
+    """List the tasks in a DAG."""
+    dag_id = arguments["dag_id"]
+    result = await make_api_request("GET", f"dags/{dag_id}/tasks")
+    tasks = result.get("tasks", [])
+    
+    parts = [f"Tasks in DAG '{dag_id}' ({len(tasks)} tasks):\n\n"]
+    for task in tasks:
+        operator_name, downstream = get_fields(
+            task, ("operator_name", "downstream_task_ids"), default=("N/A", ())
+        )
+        parts.append(
+            f"- **{task['task_id']}**\n"
+            f"  - Type: {operator_name}\n"
+            f"  - Downstream: {', '.join(downstream)}\n\n"
+        )
+    
+    return "".join(parts)
+
+
+async def _handle_trigger_dag_run(arguments: dict) -> str:
+    """Trigger a new DAG run."""
+    dag_id = arguments["dag_id"]
+    conf = arguments.get("conf", {})
+    logical_date = arguments.get("logical_date")
+    
+    body = {}
+    if conf:
+        body["conf"] = conf
+    if logical_date:
+        body["logical_date"] = logical_date
+    
+    result = await make_api_request("POST", f"dags/{dag_id}/dagRuns", json_data=body)
+    
+    summary = (
+        f"✅ DAG run triggered successfully!\n\n"
+        f"- **DAG ID**: {result['dag_id']}\n"
+        f"- **Run ID**: {result['dag_run_id']}\n"
+        f"- **State**: {result['state']}\n"
+        f"- **Execution Date**: {result.get('execution_date', 'N/A')}\n"
+    )
+    
+    return summary
+
+
+async def _handle_clear_dag_run(arguments: dict) -> str:
+    """Clear/retry a DAG run."""
+    dag_id = arguments["dag_id"]
+    dag_run_id = arguments["dag_run_id"]
+    dry_run = arguments.get("dry_run", False)
+    
+    body = {"dry_run": dry_run}
+    result = await make_api_request("POST", f"dags/{dag_id}/dagRuns/{dag_run_id}/clear", json_data=body)
+    
+    if dry_run:
+        parts = ["🔍 Dry run - Tasks that would be cleared:\n\n"]
+    else:
+        parts = ["✅ DAG run cleared successfully!\n\n"]
+    
+    task_instances = result.get("task_instances", [])
+    for ti in task_instances:
+        task_id, try_number = get_fields(ti, ("task_id", "try_number"))
+        parts.append(f"- {task_id} (Try: {try_number})\n")
+    
+    return "".join(parts)
+
+
+async def _handle_set_dag_state(arguments: dict) -> str:
+    """Pause or unpause a DAG."""
+    dag_id = arguments["dag_id"]
+    is_paused = arguments["is_paused"]
+    
+    body = {"is_paused": is_paused}
+    result = await make_api_request("PATCH", f"dags/{dag_id}", json_data=body)
+    
+    state_str = "⏸️ PAUSED" if is_paused else "▶️ ACTIVE"
+    description, schedule = get_fields(result, ("description", "schedule_interval"))
+    summary = (
+        f"✅ DAG '{dag_id}' is now {state_str}\n\n"
+        f"- **Description**: {description}\n"
+        f"- **Schedule**: {schedule}\n"
+    )
+    
+    return summary
+
+
+# Monitoring & Status Tools
+
+async def _handle_get_dag_runs(arguments: dict) -> str:
+    """List DAG run history with optional state filtering."""
+    dag_id = arguments["dag_id"]
+    state = arguments.get("state")
+    limit = arguments.get("limit", 25)
+    
+    params = {"limit": limit}
+    if state:
+        params["state"] = state
+    
+    result = await make_api_request(
+        "GET", f"dags/{dag_id}/dagRuns", params=params, response_type=DagRunCollection
+    )
+    dag_runs = result.dag_runs
+    
+    parts = [f"DAG runs for '{dag_id}' ({len(dag_runs)} runs):\n\n"]
+    for run in dag_runs:
+        state_emoji = _RUN_STATE_EMOJI.get((run.state or "").lower(), "❓")
+        parts.append(
+            f"{state_emoji} **{run.dag_run_id}**\n"
+            f"  - State: {run.state}\n"
+            f"  - Start: {run.start_date}\n"
+            f"  - End: {run.end_date}\n\n"
+        )
+    
+    return "".join(parts)
+
+
+async def _handle_get_task_instances(arguments: dict) -> str:
+    """List task instances for a DAG run."""
+    dag_id = arguments["dag_id"]
+    dag_run_id = arguments["dag_run_id"]
+    
+    result = await make_api_request(
+        "GET", f"dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances", response_type=TaskInstanceCollection
+    )
+    task_instances = result.task_instances
+    
+    parts = [f"Task instances for '{dag_id}' run '{dag_run_id}':\n\n"]
+    for ti in task_instances:
+        state_emoji = _TI_STATE_EMOJI.get((ti.state or "").lower(), "❓")
+        parts.append(
+            f"{state_emoji} **{ti.task_id}**\n"
+            f"  - State: {ti.state}\n"
+            f"  - Try Number: {ti.try_number}\n"
+            f"  - Duration: {ti.duration}s\n\n"
+        )
+    
+    return "".join(parts)
+
+
+async def _handle_get_dag_stats(arguments: dict) -> str:
+    """Summarize run state counts for all DAGs."""
+    # dagStats aggregates the per-state counts server-side, so one request covers
+    # every DAG - avoid per-DAG follow-up requests here
+    result = await make_api_request("GET", "dagStats")
+    stats = result.get("dags", [])
+    
+    parts = ["📊 DAG Statistics:\n\n"]
+    for dag_stat in stats:
+        parts.append(f"**{dag_stat['dag_id']}**:\n")
+        parts.extend(
+            f"  - {state_stat['state']}: {state_stat['count']}\n"
+            for state_stat in dag_stat.get("stats", [])
+        )
+        parts.append("\n")
+    
+    return "".join(parts)
+
+
+# Debugging & Logs Tools
+
+async def _handle_get_task_logs(arguments: dict) -> str:
+    """Fetch logs for a task instance, falling back to its status details."""
+    dag_id = arguments["dag_id"]
+    dag_run_id = arguments["dag_run_id"]
+    task_id = arguments["task_id"]
+    try_number = arguments.get("try_number", 1)
+    
+    # Note: Airflow API v2 doesn't have a direct log endpoint, we need to construct it
+    # The endpoint follows this pattern for log retrieval
+    endpoint = f"dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}/logs/{try_number}"
+    ti_endpoint = f"dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}"
+    
+    # The logs endpoint often fails, so fetch the task instance info alongside it
+    # rather than waiting for the failure before issuing the fallback request
+    result, ti_result = await asyncio.gather(
+        stream_log_events(endpoint),
+        make_api_request("GET", ti_endpoint),
+        return_exceptions=True,
+    )
+    
+    if not isinstance(result, BaseException):
+        log_content = result
         
-        # Knowledge Tools
-        Tool(
-            name="get_airflow3_skill",
-            description="Get Airflow 3 development guidelines and syntax changes",
-            inputSchema={
-                "type": "object",
-                "properties": {},
-            },
-        ),
+        # Join once so the (potentially large) log is copied a single time
+        summary = "".join((
+            f"📝 Logs for task '{task_id}' (Try #{try_number}):\n\n",
+            "```\n",
+            log_content,
+            "\n```",
+        ))
         
-        # Health Check Tool
-        Tool(
-            name="check_health",
-            description="Check Airflow system health (scheduler and database status)",
-            inputSchema={
-                "type": "object",
-                "properties": {},
-            },
-        ),
-    ]
+        return summary
+    
+    # If logs endpoint fails, fall back to the task instance info
+    if isinstance(ti_result, BaseException):
+        raise ti_result
+    
+    state, ti_try_number, start_date, end_date = get_fields(
+        ti_result, ("state", "try_number", "start_date", "end_date")
+    )
+    summary = (
+        f"ℹ️ Task Instance Info for '{task_id}':\n\n"
+        f"- State: {state}\n"
+        f"- Try Number: {ti_try_number}\n"
+        f"- Start Date: {start_date}\n"
+        f"- End Date: {end_date}\n\n"
+        f"⚠️ Note: Direct log retrieval failed. You may need to access logs through the Airflow UI at:\n"
+        f"{CFG.base_url}/dags/{dag_id}/grid?dag_run_id={dag_run_id}&task_id={task_id}\n\n"
+        f"Error: {str(result)}"
+    )
+    
+    return summary
 
 
-@app.call_tool()
-async def call_tool(name: str, arguments: Any) -> list[TextContent]:
-    """Handle tool calls."""
+async def _handle_get_import_errors(arguments: dict) -> str:
+    """List DAG import/parsing errors."""
+    result = await make_api_request("GET", "importErrors")
+    errors = result.get("import_errors", [])
+    
+    if not errors:
+        summary = "✅ No DAG import errors found!"
+    else:
+        parts = [f"⚠️ Found {len(errors)} DAG import errors:\n\n"]
+        for error in errors:
+            filename, stack_trace = get_fields(
+                error, ("filename", "stack_trace"), default=("Unknown file", "No error details")
+            )
+            parts.append(f"**{filename}**:\n```\n{stack_trace}\n```\n\n")
+        summary = "".join(parts)
+    
+    return summary
+
+
+# Connection Management Tools
+
+async def _handle_get_connections(arguments: dict) -> str:
+    """List Airflow connections."""
+    limit = arguments.get("limit", 100)
+    result = await make_api_request(
+        "GET", "connections", params={"limit": limit}, response_type=ConnectionCollection
+    )
+    connections = result.connections
+    
+    parts = [f"🔌 Airflow Connections ({len(connections)} connections):\n\n"]
+    parts.extend(
+        f"- **{conn.connection_id}**\n"
+        f"  - Type: {conn.conn_type}\n"
+        f"  - Host: {conn.host}\n"
+        f"  - Schema: {conn.schema}\n\n"
+        for conn in connections
+    )
+    
+    return "".join(parts)
+
+
+async def _handle_get_connection(arguments: dict) -> str:
+    """Show details of a single connection."""
+    connection_id = arguments["connection_id"]
+    result = await make_api_request("GET", f"connections/{connection_id}")
     
+    conn_type, host, schema, login, port, extra = get_fields(
+        result, ("conn_type", "host", "schema", "login", "port", "extra")
+    )
+    summary = (
+        f"🔌 Connection Details: **{connection_id}**\n\n"
+        f"- **Type**: {conn_type}\n"
+        f"- **Host**: {host}\n"
+        f"- **Schema**: {schema}\n"
+        f"- **Login**: {login}\n"
+        f"- **Port**: {port}\n"
+        f"- **Extra**: {extra}\n"
+    )
+    
+    return summary
+
+
+async def _handle_test_connection(arguments: dict) -> str:
+    """Check that a connection is retrievable through the API."""
+    connection_id = arguments["connection_id"]
+    
+    # Try to get the connection - if it exists and is retrievable, it's "working" at the API level
     try:
-        # DAG Management Tools
-        if name == "get_dags":
-            only_active = arguments.get("only_active", False)
-            limit = arguments.get("limit", 100)
-            
-            params = {"limit": limit}
-            if only_active:
-                params["only_active"] = "true"
-            
-            result = await make_api_request("GET", "dags", params=params)
-            dags = result.get("dags", [])
-            
-            summary = f"Found {len(dags)} DAGs:\n\n"
-            for dag in dags:
-                status = "⏸️ Paused" if dag.get("is_paused") else "▶️ Active"
-                summary += f"- **{dag['dag_id']}** ({status})\n"
-                summary += f"  - Description: {dag.get('description', 'N/A')}\n"
-                summary += f"  - Schedule: {dag.get('schedule_interval', 'N/A')}\n\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "get_dag_tasks":
-            dag_id = arguments["dag_id"]
-            result = await make_api_request("GET", f"dags/{dag_id}/tasks")
-            tasks = result.get("tasks", [])
-            
-            summary = f"Tasks in DAG '{dag_id}' ({len(tasks)} tasks):\n\n"
-            for task in tasks:
-                summary += f"- **{task['task_id']}**\n"
-                summary += f"  - Type: {task.get('operator_name', 'N/A')}\n"
-                summary += f"  - Downstream: {', '.join(task.get('downstream_task_ids', []))}\n\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "trigger_dag_run":
-            dag_id = arguments["dag_id"]
-            conf = arguments.get("conf", {})
-            logical_date = arguments.get("logical_date")
-            
-            body = {}
-            if conf:
-                body["conf"] = conf
-            if logical_date:
-                body["logical_date"] = logical_date
-            
-            result = await make_api_request("POST", f"dags/{dag_id}/dagRuns", json_data=body)
-            
-            summary = f"✅ DAG run triggered successfully!\n\n"
-            summary += f"- **DAG ID**: {result['dag_id']}\n"
-            summary += f"- **Run ID**: {result['dag_run_id']}\n"
-            summary += f"- **State**: {result['state']}\n"
-            summary += f"- **Execution Date**: {result.get('execution_date', 'N/A')}\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "clear_dag_run":
-            dag_id = arguments["dag_id"]
-            dag_run_id = arguments["dag_run_id"]
-            dry_run = arguments.get("dry_run", False)
-            
-            body = {"dry_run": dry_run}
-            result = await make_api_request("POST", f"dags/{dag_id}/dagRuns/{dag_run_id}/clear", json_data=body)
-            
-            if dry_run:
-                summary = "🔍 Dry run - Tasks that would be cleared:\n\n"
-            else:
-                summary = "✅ DAG run cleared successfully!\n\n"
-            
-            task_instances = result.get("task_instances", [])
-            for ti in task_instances:
-                summary += f"- {ti['task_id']} (Try: {ti.get('try_number', 'N/A')})\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "set_dag_state":
-            dag_id = arguments["dag_id"]
-            is_paused = arguments["is_paused"]
-            
-            body = {"is_paused": is_paused}
-            result = await make_api_request("PATCH", f"dags/{dag_id}", json_data=body)
-            
-            state_str = "⏸️ PAUSED" if is_paused else "▶️ ACTIVE"
-            summary = f"✅ DAG '{dag_id}' is now {state_str}\n\n"
-            summary += f"- **Description**: {result.get('description', 'N/A')}\n"
-            summary += f"- **Schedule**: {result.get('schedule_interval', 'N/A')}\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        # Monitoring & Status Tools
-        elif name == "get_dag_runs":
-            dag_id = arguments["dag_id"]
-            state = arguments.get("state")
-            limit = arguments.get("limit", 25)
-            
-            params = {"limit": limit}
-            if state:
-                params["state"] = state
-            
-            result = await make_api_request("GET", f"dags/{dag_id}/dagRuns", params=params)
-            dag_runs = result.get("dag_runs", [])
-            
-            summary = f"DAG runs for '{dag_id}' ({len(dag_runs)} runs):\n\n"
-            for run in dag_runs:
-                state_emoji = {
-                    "success": "✅",
-                    "failed": "❌",
-                    "running": "🔄",
-                    "queued": "⏳",
-                }.get(run.get("state", "").lower(), "❓")
-                
-                summary += f"{state_emoji} **{run['dag_run_id']}**\n"
-                summary += f"  - State: {run.get('state', 'N/A')}\n"
-                summary += f"  - Start: {run.get('start_date', 'N/A')}\n"
-                summary += f"  - End: {run.get('end_date', 'N/A')}\n\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "get_task_instances":
-            dag_id = arguments["dag_id"]
-            dag_run_id = arguments["dag_run_id"]
-            
-            result = await make_api_request("GET", f"dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances")
-            task_instances = result.get("task_instances", [])
-            
-            summary = f"Task instances for '{dag_id}' run '{dag_run_id}':\n\n"
-            for ti in task_instances:
-                state_emoji = {
-                    "success": "✅",
-                    "failed": "❌",
-                    "running": "🔄",
-                    "queued": "⏳",
-                    "skipped": "⏭️",
-                }.get(ti.get("state", "").lower(), "❓")
-                
-                summary += f"{state_emoji} **{ti['task_id']}**\n"
-                summary += f"  - State: {ti.get('state', 'N/A')}\n"
-                summary += f"  - Try Number: {ti.get('try_number', 'N/A')}\n"
-                summary += f"  - Duration: {ti.get('duration', 'N/A')}s\n\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "get_dag_stats":
-            result = await make_api_request("GET", "dagStats")
-            stats = result.get("dags", [])
-            
-            summary = "📊 DAG Statistics:\n\n"
-            for dag_stat in stats:
-                summary += f"**{dag_stat['dag_id']}**:\n"
-                for state_stat in dag_stat.get("stats", []):
-                    summary += f"  - {state_stat['state']}: {state_stat['count']}\n"
-                summary += "\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        # Debugging & Logs Tools
-        elif name == "get_task_logs":
-            dag_id = arguments["dag_id"]
-            dag_run_id = arguments["dag_run_id"]
-            task_id = arguments["task_id"]
-            try_number = arguments.get("try_number", 1)
-            
-            # Note: Airflow API v2 doesn't have a direct log endpoint, we need to construct it
-            # The endpoint follows this pattern for log retrieval
-            endpoint = f"dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}/logs/{try_number}"
-            
-            try:
-                result = await make_api_request("GET", endpoint)
-                
-                if isinstance(result, dict):
-                    log_content = result.get("content", str(result))
-                else:
-                    log_content = str(result)
-                
-                summary = f"📝 Logs for task '{task_id}' (Try #{try_number}):\n\n"
-                summary += "```\n"
-                summary += log_content
-                summary += "\n```"
-                
-                return [TextContent(type="text", text=summary)]
-            except Exception as e:
-                # If logs endpoint fails, try to get task instance info
-                ti_result = await make_api_request("GET", f"dags/{dag_id}/dagRuns/{dag_run_id}/taskInstances/{task_id}")
-                
-                summary = f"ℹ️ Task Instance Info for '{task_id}':\n\n"
-                summary += f"- State: {ti_result.get('state', 'N/A')}\n"
-                summary += f"- Try Number: {ti_result.get('try_number', 'N/A')}\n"
-                summary += f"- Start Date: {ti_result.get('start_date', 'N/A')}\n"
-                summary += f"- End Date: {ti_result.get('end_date', 'N/A')}\n\n"
-                summary += f"⚠️ Note: Direct log retrieval failed. You may need to access logs through the Airflow UI at:\n"
-                summary += f"{AIRFLOW_BASE_URL}/dags/{dag_id}/grid?dag_run_id={dag_run_id}&task_id={task_id}\n\n"
-                summary += f"Error: {str(e)}"
-                
-                return [TextContent(type="text", text=summary)]
+        result = await make_api_request("GET", f"connections/{connection_id}", cache_bypass=True)
         
-        elif name == "get_import_errors":
-            result = await make_api_request("GET", "importErrors")
-            errors = result.get("import_errors", [])
-            
-            if not errors:
-                summary = "✅ No DAG import errors found!"
-            else:
-                summary = f"⚠️ Found {len(errors)} DAG import errors:\n\n"
-                for error in errors:
-                    summary += f"**{error.get('filename', 'Unknown file')}**:\n"
-                    summary += f"```\n{error.get('stack_trace', 'No error details')}\n```\n\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        # Connection Management Tools
-        elif name == "get_connections":
-            limit = arguments.get("limit", 100)
-            result = await make_api_request("GET", "connections", params={"limit": limit})
-            connections = result.get("connections", [])
-            
-            summary = f"🔌 Airflow Connections ({len(connections)} connections):\n\n"
-            for conn in connections:
-                summary += f"- **{conn['connection_id']}**\n"
-                summary += f"  - Type: {conn.get('conn_type', 'N/A')}\n"
-                summary += f"  - Host: {conn.get('host', 'N/A')}\n"
-                summary += f"  - Schema: {conn.get('schema', 'N/A')}\n\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
-        elif name == "get_connection":
-            connection_id = arguments["connection_id"]
-            result = await make_api_request("GET", f"connections/{connection_id}")
-            
-            summary = f"🔌 Connection Details: **{connection_id}**\n\n"
-            summary += f"- **Type**: {result.get('conn_type', 'N/A')}\n"
-            summary += f"- **Host**: {result.get('host', 'N/A')}\n"
-            summary += f"- **Schema**: {result.get('schema', 'N/A')}\n"
-            summary += f"- **Login**: {result.get('login', 'N/A')}\n"
-            summary += f"- **Port**: {result.get('port', 'N/A')}\n"
-            summary += f"- **Extra**: {result.get('extra', 'N/A')}\n"
-            
-            return [TextContent(type="text", text=summary)]
+        conn_type, host = get_fields(result, ("conn_type", "host"))
+        summary = (
+            f"✅ Connection '{connection_id}' is accessible!\n\n"
+            f"- **Type**: {conn_type}\n"
+            f"- **Host**: {host}\n\n"
+            "ℹ️ Note: This tests API accessibility. To test actual connectivity to the external service, "
+            "you'll need to trigger a DAG that uses this connection.\n"
+        )
         
-        elif name == "test_connection":
-            connection_id = arguments["connection_id"]
-            
-            # Try to get the connection - if it exists and is retrievable, it's "working" at the API level
-            try:
-                result = await make_api_request("GET", f"connections/{connection_id}")
-                
-                summary = f"✅ Connection '{connection_id}' is accessible!\n\n"
-                summary += f"- **Type**: {result.get('conn_type', 'N/A')}\n"
-                summary += f"- **Host**: {result.get('host', 'N/A')}\n\n"
-                summary += "ℹ️ Note: This tests API accessibility. To test actual connectivity to the external service, "
-                summary += "you'll need to trigger a DAG that uses this connection.\n"
-                
-                return [TextContent(type="text", text=summary)]
-            except Exception as e:
-                summary = f"❌ Connection test failed for '{connection_id}':\n\n"
-                summary += f"Error: {str(e)}\n"
-                
-                return [TextContent(type="text", text=summary)]
+        return summary
+    except Exception as e:
+        summary = f"❌ Connection test failed for '{connection_id}':\n\nError: {str(e)}\n"
         
-        # Knowledge Tools
-        elif name == "get_airflow3_skill":
-            skill_path = Path(__file__).parent / "skill-airflow3.md"
-            try:
-                content = skill_path.read_text(encoding="utf-8")
-                return [TextContent(type="text", text=content)]
-            except Exception as e:
-                return [TextContent(type="text", text=f"Error reading skill file: {e}")]
+        return summary
+
+
+# Knowledge Tools
+
+async def _handle_get_airflow3_skill(arguments: dict) -> str:
+    """Return the bundled Airflow 3 guidelines."""
+    skill_path = Path(__file__).parent / "skill-airflow3.md"
+    try:
+        content = skill_path.read_text(encoding="utf-8")
+        return content
+    except Exception as e:
+        return f"Error reading skill file: {e}"
+
+
+# Health Check Tool
+
+async def _handle_check_health(arguments: dict) -> str:
+    """Report scheduler, metadatabase, triggerer and DAG processor health."""
+    # Using the monitor/health endpoint which provides status for all components
+    # Ref: https://airflow.apache.org/docs/apache-airflow/stable/administration-and-deployment/logging-monitoring/check-health.html
+    result = await make_api_request("GET", "monitor/health")
+    
+    parts = ["🏥 Airflow Health Status:\n\n"]
+    
+    # Components to check
+    components = [
+        ("metadatabase", "Metadatabase"),
+        ("scheduler", "Scheduler"),
+        ("triggerer", "Triggerer"),
+        ("dag_processor", "Dag Processor")
+    ]
+    
+    for key, label in components:
+        component_data = result.get(key)
         
-        # Health Check Tool
-        elif name == "check_health":
-            # Using the monitor/health endpoint which provides status for all components
-            # Ref: https://airflow.apache.org/docs/apache-airflow/stable/administration-and-deployment/logging-monitoring/check-health.html
-            result = await make_api_request("GET", "monitor/health")
+        # Some components might not be present in the response if not configured/running
+        if component_data:
+            status = component_data.get("status", "unknown")
+            # heartbeat timestamp if available
+            heartbeatkey = f"latest_{key}_heartbeat"
+            heartbeat = component_data.get(heartbeatkey)
             
-            summary = "🏥 Airflow Health Status:\n\n"
+            emoji = "✅" if status == "healthy" else "❌"
+            parts.append(f"{emoji} **{label}**: {status}\n")
             
-            # Components to check
-            components = [
-                ("metadatabase", "Metadatabase"),
-                ("scheduler", "Scheduler"),
-                ("triggerer", "Triggerer"),
-                ("dag_processor", "Dag Processor")
-            ]
-            
-            for key, label in components:
-                component_data = result.get(key)
-                
-                # Some components might not be present in the response if not configured/running
-                if component_data:
-                    status = component_data.get("status", "unknown")
-                    # heartbeat timestamp if available
-                    heartbeatkey = f"latest_{key}_heartbeat"
-                    heartbeat = component_data.get(heartbeatkey)
-                    
-                    emoji = "✅" if status == "healthy" else "❌"
-                    summary += f"{emoji} **{label}**: {status}\n"
-                    
-                    if heartbeat:
-                        summary += f"   Last Heartbeat: {heartbeat}\n"
-                else:
-                    # Optional components like triggerer might be missing
-                    if key not in ["metadatabase", "scheduler"]:
-                        summary += f"⚪ **{label}**: Not active/configured\n"
-            
-            return [TextContent(type="text", text=summary)]
-        
+            if heartbeat:
+                parts.append(f"   Last Heartbeat: {heartbeat}\n")
         else:
+            # Optional components like triggerer might be missing
+            if key not in ["metadatabase", "scheduler"]:
+                parts.append(f"⚪ **{label}**: Not active/configured\n")
+    
+    return "".join(parts)
+
+
+_HANDLERS: dict[str, Callable[[dict], Awaitable[str]]] = {
+    "get_dags": _handle_get_dags,
+    "get_dag_tasks": _handle_get_dag_tasks,
+    "trigger_dag_run": _handle_trigger_dag_run,
+    "clear_dag_run": _handle_clear_dag_run,
+    "set_dag_state": _handle_set_dag_state,
+    "get_dag_runs": _handle_get_dag_runs,
+    "get_task_instances": _handle_get_task_instances,
+    "get_dag_stats": _handle_get_dag_stats,
+    "get_task_logs": _handle_get_task_logs,
+    "get_import_errors": _handle_get_import_errors,
+    "get_connections": _handle_get_connections,
+    "get_connection": _handle_get_connection,
+    "test_connection": _handle_test_connection,
+    "get_airflow3_skill": _handle_get_airflow3_skill,
+    "check_health": _handle_check_health,
+}
+
+
+@app.call_tool()
+async def call_tool(name: str, arguments: Any) -> list[TextContent]:
+    """Handle tool calls."""
+    
+    try:
+        handler = _HANDLERS.get(name)
+        if handler is None:
             raise ValueError(f"Unknown tool: {name}")
+        
+        text = await handler(arguments or {})
+        return [TextContent(type="text", text=text)]
     
     except Exception as e:
         error_msg = f"❌ Error executing '{name}':\n\n{str(e)}"
         return [TextContent(type="text", text=error_msg)]
 
 
-def auto_update_check():
+# Startup update check - lock file shared by concurrently starting server instances
+UPDATE_LOCK_FILE = ".mcp_update.lock"
+UPDATE_CHECK_INTERVAL = 300  # seconds
+UPDATE_SHUTDOWN_TIMEOUT = 60  # seconds, longer than the fetch + rev-list + pull timeouts combined
+
+
+async def run_git(*args: str, cwd: Path, timeout: float) -> tuple[int, str, str]:
+    """
+    Run a git command without blocking the event loop.
+    
+    Returns:
+        Tuple of (return code, stdout, stderr)
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "git", *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    # communicate() runs as its own task so the pipes keep draining even if this
+    # coroutine is cancelled - git would otherwise die of SIGPIPE mid-operation
+    communicate = asyncio.ensure_future(proc.communicate())
+    try:
+        stdout, stderr = await asyncio.wait_for(asyncio.shield(communicate), timeout=timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await communicate
+        raise
+    except asyncio.CancelledError:
+        # Let git finish (e.g. a pull updating the working tree) rather than orphaning it
+        try:
+            await asyncio.wait_for(asyncio.shield(communicate), timeout=timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await communicate
+        raise
+    return proc.returncode, stdout.decode(), stderr.decode()
+
+
+def try_lock_file(lock_file) -> bool:
+    """Take a non-blocking exclusive lock on an open file; False if another process holds it."""
+    try:
+        if sys.platform == "win32":
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+async def check_for_updates(repo_path: Path) -> bool:
+    """
+    Fetch from the remote and fast-forward if the upstream branch has new commits.
+    
+    Returns:
+        True if the remote was fetched and compared, False if either step failed
+    """
+    # Fetch latest from remote
+    returncode, _, stderr = await run_git("fetch", cwd=repo_path, timeout=10)
+    
+    if returncode != 0:
+        print(f"Warning: git fetch failed: {stderr}", file=sys.stderr)
+        return False
+    
+    # Count commits on the upstream branch that are not in HEAD yet
+    returncode, stdout, stderr = await run_git("rev-list", "--count", "HEAD..@{u}", cwd=repo_path, timeout=5)
+    
+    if returncode != 0:
+        print(f"Warning: git upstream check failed: {stderr.strip()}", file=sys.stderr)
+        return False
+    
+    if int(stdout) > 0:
+        print("📥 Update available, pulling latest version...", file=sys.stderr)
+        
+        # Only fast-forward to be safe
+        returncode, _, stderr = await run_git("pull", "--ff-only", cwd=repo_path, timeout=30)
+        
+        if returncode == 0:
+            print("✅ Successfully updated to latest version!", file=sys.stderr)
+            print("⚠️  Please restart Claude Desktop to use the new version", file=sys.stderr)
+        else:
+            print(f"❌ Update failed: {stderr}", file=sys.stderr)
+    else:
+        print("✅ Already up to date", file=sys.stderr)
+    
+    return True
+
+
+async def auto_update_check():
     """Check for updates on startup"""
+    # stdout carries the MCP protocol while this runs alongside the server, so log to stderr
     if os.getenv("GIT_AUTO_UPDATE") != "true":
-        print('GIT_AUTO_UPDATE is false, skipping the update.')
+        print('GIT_AUTO_UPDATE is false, skipping the update.', file=sys.stderr)
         return  # Skip if not enabled
     
     try:
         repo_path = Path(__file__).parent
         
-        # Fetch latest from remote
-        result = subprocess.run(
-            ["git", "fetch"], 
-            cwd=repo_path, 
-            capture_output=True,
-            timeout=10
-        )
-        
-        if result.returncode != 0:
-            print(f"Warning: git fetch failed: {result.stderr.decode()}")
-            return
-        
-        # Check if behind remote
-        result = subprocess.run(
-            ["git", "status", "-uno", "-sb"], 
-            cwd=repo_path, 
-            capture_output=True, 
-            text=True,
-            timeout=5
-        )
-        
-        if result.returncode != 0:
-            print(f"Warning: git status check failed")
-            return
-        
-        # Look for "behind" indicator
-        if "behind" in result.stdout.lower():
-            print("📥 Update available, pulling latest version...")
+        # Only one server instance may run git at a time. The lock file also records
+        # when the last check ran, so rapid restarts don't fetch again.
+        with open(repo_path / UPDATE_LOCK_FILE, "a+") as lock_file:
+            if not try_lock_file(lock_file):
+                print("⏭️  Another instance is already checking for updates", file=sys.stderr)
+                return
             
-            pull_result = subprocess.run(
-                ["git", "pull", "--ff-only"],  # Only fast-forward to be safe
-                cwd=repo_path,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            lock_file.seek(0)
+            try:
+                last_checked = float(lock_file.read().strip() or 0)
+            except ValueError:
+                last_checked = 0.0
             
-            if pull_result.returncode == 0:
-                print("✅ Successfully updated to latest version!")
-                print("⚠️  Please restart Claude Desktop to use the new version")
-            else:
-                print(f"❌ Update failed: {pull_result.stderr}")
-        else:
-            print("✅ Already up to date")
+            if time.time() - last_checked < UPDATE_CHECK_INTERVAL:
+                print("✅ Checked for updates recently, skipping", file=sys.stderr)
+                return
+            
+            # Only record the check once it actually reached the remote, so a failed
+            # fetch (e.g. no network at startup) is retried on the next restart
+            if await check_for_updates(repo_path):
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(str(time.time()))
+                lock_file.flush()
                 
-    except subprocess.TimeoutExpired:
-        print("⚠️  Update check timed out")
+    except asyncio.TimeoutError:
+        print("⚠️  Update check timed out", file=sys.stderr)
     except FileNotFoundError:
-        print("⚠️  Git not found - skipping auto-update")
+        print("⚠️  Git not found - skipping auto-update", file=sys.stderr)
     except Exception as e:
         # Don't crash the server if update fails
-        print(f"⚠️  Auto-update check failed: {str(e)}")
+        print(f"⚠️  Auto-update check failed: {str(e)}", file=sys.stderr)
 
 
 
 async def main():
     """Run the MCP server."""
-    print('checking the update..')
-    # update the code
-    auto_update_check()
-
-    print('the server is running..')
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            app.create_initialization_options(),
-        )
+    print('checking the update..', file=sys.stderr)
+    # update the code in the background so the server can start serving immediately
+    update_task = asyncio.create_task(auto_update_check())
+
+    print('the server is running..', file=sys.stderr)
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await app.run(
+                read_stream,
+                write_stream,
+                app.create_initialization_options(),
+            )
+    finally:
+        # Don't interrupt an in-flight update - killing git pull partway through can
+        # leave a stale .git/index.lock or a half-updated checkout
+        if not update_task.done():
+            print('waiting for the update check to finish..', file=sys.stderr)
+            try:
+                await asyncio.wait_for(asyncio.shield(update_task), timeout=UPDATE_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                print('⚠️  Update check still running at shutdown', file=sys.stderr)
+        await _CLIENT.aclose()
 
 
 if __name__ == "__main__":